@@ -4,12 +4,14 @@ Fixed FastAPI Agno AI Processing API with improved large JSON handling
 """
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import json
-import pandas as pd
+import asyncio
+import math
 import tempfile
 import uuid
 from datetime import datetime, timedelta
@@ -20,16 +22,367 @@ import uvicorn
 import glob
 from pathlib import Path
 import sys
+from collections import deque, OrderedDict
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import asynccontextmanager, contextmanager
+import tracemalloc
+import functools
+import zlib
+import re
+import importlib.util
+import shutil
+import itertools
+import hashlib
+
+# Optional: zstd request bodies are only accepted when zstandard is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Increase recursion limit for large JSON
 sys.setrecursionlimit(10000)
 
-# Agno imports
-from agno.agent import Agent
-from agno.models.google import Gemini
-from agno.tools.python import PythonTools
+# Heavy dependencies (pandas, Agno, Gemini) are imported lazily by load_engines(),
+# either by the warm-up thread started in the app lifespan or by the first request
+pd = None
+Agent = None
+Gemini = None
+PythonTools = None
+
+engines_lock = threading.Lock()
+engine_status = {
+    'state': 'pending',  # pending -> loading -> ready | failed
+    'started_at': None,
+    'ready_at': None,
+    'load_seconds': None,
+    'error': None
+}
+
+def load_engines():
+    """Import the conversion engines once; safe to call from any thread"""
+    global pd, Agent, Gemini, PythonTools
+    
+    if engine_status['state'] == 'ready':
+        return
+    
+    with engines_lock:
+        if engine_status['state'] == 'ready':
+            return
+        
+        engine_status['state'] = 'loading'
+        engine_status['started_at'] = datetime.now()
+        start = time.monotonic()
+        try:
+            import pandas
+            from agno.agent import Agent as agno_agent
+            from agno.models.google import Gemini as agno_gemini
+            from agno.tools.python import PythonTools as agno_python_tools
+        except Exception as e:
+            engine_status['state'] = 'failed'
+            engine_status['error'] = str(e)
+            print(f"❌ Failed to load conversion engines: {str(e)}")
+            raise
+        
+        pd = pandas
+        Agent = agno_agent
+        Gemini = agno_gemini
+        PythonTools = agno_python_tools
+        
+        engine_status['load_seconds'] = round(time.monotonic() - start, 3)
+        engine_status['ready_at'] = datetime.now()
+        engine_status['error'] = None
+        engine_status['state'] = 'ready'
+        print(f"🔥 Conversion engines loaded in {engine_status['load_seconds']}s")
+
+def warm_up_engines():
+    """Background warm-up so the first request does not pay the import cost"""
+    try:
+        load_engines()
+    except Exception:
+        pass  # Reported through /ready; requests retry the load on demand
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
+    cleanup_thread.start()
+    threading.Thread(target=warm_up_engines, daemon=True).start()
+    yield
+    llm_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="Agno AI JSON to XLSX Processing API", version="2.1.0", lifespan=lifespan)
+
+# Global storage for temporary files
+temp_files = {}
+file_locks = {}  # file_id -> lock serializing appends and materialization
+file_locks_guard = threading.Lock()
+TEMP_DIR = tempfile.mkdtemp(prefix="agno_xlsx_")
+
+# LLM call budget: overall deadline per request, retries and optional hedging
+LLM_TIMEOUT_SECONDS = float(os.getenv("AGNO_LLM_TIMEOUT_SECONDS", "90"))
+LLM_MAX_RETRIES = int(os.getenv("AGNO_LLM_MAX_RETRIES", "1"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("AGNO_LLM_RETRY_BACKOFF_SECONDS", "1.0"))
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("AGNO_LLM_HEDGE_AFTER_SECONDS", "0"))  # 0 disables hedging
+LLM_MAX_WORKERS = int(os.getenv("AGNO_LLM_MAX_WORKERS", "8"))
+
+# Circuit breaker: open a model's circuit after repeated failures or slow calls
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("AGNO_CIRCUIT_WINDOW_SECONDS", "120"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AGNO_CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("AGNO_CIRCUIT_SLOW_CALL_SECONDS", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("AGNO_CIRCUIT_OPEN_SECONDS", "60"))
+
+# Compressed request bodies (Content-Encoding: gzip / zstd)
+MAX_DECOMPRESSED_BODY_BYTES = int(os.getenv("AGNO_MAX_DECOMPRESSED_BODY_BYTES", str(256 * 1024 * 1024)))
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+# zstd output cannot be capped per call; a compressed byte expands to at most ~32KB
+# (an RLE block), so feeding 32 bytes at a time bounds each step to ~DECOMPRESS_CHUNK_BYTES
+ZSTD_INPUT_STEP_BYTES = 32
+DECOMPRESS_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard else (zlib.error,)
+
+# Workbook writing: xlsxwriter is much faster than openpyxl when it is installed
+EXCEL_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+CATEGORY_MAX_UNIQUE = 1000
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+TYPE_SAMPLE_SIZE = 200
+
+# Sheet previews: first rows of every sheet, cached next to the workbook
+PREVIEW_ROWS = int(os.getenv("AGNO_PREVIEW_ROWS", "50"))
+
+# Per-request resource accounting
+# "rss" samples process RSS growth (cheap, not a peak allocation: the allocator keeps freed
+# memory, so requests after a heavy one report less), "tracemalloc" measures peak Python
+# allocations (slow), "off" disables
+MEMORY_TRACKING = os.getenv("AGNO_MEMORY_TRACKING", "rss")
+MEMORY_SAMPLE_INTERVAL_SECONDS = float(os.getenv("AGNO_MEMORY_SAMPLE_INTERVAL_SECONDS", "0.02"))
+REQUEST_METRICS_HISTORY = int(os.getenv("AGNO_REQUEST_METRICS_HISTORY", "500"))
+
+# Requests above this size skip the agent and use direct conversion
+DIRECT_CONVERSION_MIN_CHARS = 100000
+
+# Inline prompts carry a compact encoding of the JSON; the limit applies to the encoded size
+PROMPT_INLINE_MAX_CHARS = int(os.getenv("AGNO_PROMPT_INLINE_MAX_CHARS", "50000"))
+PROMPT_REF_MIN_CHARS = int(os.getenv("AGNO_PROMPT_REF_MIN_CHARS", "24"))
+PROMPT_REF_MARKER = "@@"
+PROMPT_CHARS_PER_TOKEN = 4
+
+# Admission control: separate lanes so cheap direct conversions never queue behind agent runs
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGNO_AGENT_MAX_CONCURRENCY", "4"))
+AGENT_MAX_QUEUE = int(os.getenv("AGNO_AGENT_MAX_QUEUE", "16"))
+DIRECT_MAX_CONCURRENCY = int(os.getenv("AGNO_DIRECT_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+DIRECT_MAX_QUEUE = int(os.getenv("AGNO_DIRECT_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AGNO_ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+ADMISSION_MIN_FREE_MEMORY_BYTES = int(os.getenv("AGNO_ADMISSION_MIN_FREE_MEMORY_MB", "256")) * 1024 * 1024
+ADMISSION_MEMORY_PER_INPUT_BYTE = 10  # rough working-set multiplier for pandas conversion
+
+# Inline /merge documents are held in memory for the whole merge; larger merges go through file_ids
+MERGE_MAX_DOCUMENT_BYTES = int(os.getenv("AGNO_MERGE_MAX_DOCUMENT_MB", "32")) * 1024 * 1024
+
+# Per-API-key token bucket (keys are only kept as a hash fingerprint)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("AGNO_RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_BURST = int(os.getenv("AGNO_RATE_LIMIT_BURST", "10"))
+
+# Tracing: recent traces kept in memory (see /debug/traces), optionally also appended to a JSON lines file
+TRACE_BUFFER_TRACES = int(os.getenv("AGNO_TRACE_BUFFER_TRACES", "200"))
+TRACE_EXPORT_PATH = os.getenv("AGNO_TRACE_EXPORT_PATH", "")
+TRACE_SKIP_PATHS = ("/health", "/ready", "/debug/")
+
+# Agent runs execute on worker threads so they can be abandoned at the deadline
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="agno-llm")
+
+current_span = contextvars.ContextVar('current_span', default=None)
+trace_buffer = OrderedDict()  # trace_id -> finished spans, oldest trace evicted first
+trace_lock = threading.Lock()
+
+def export_span(span: Dict[str, Any]):
+    """Store a finished span in the ring buffer (and the export file if configured)"""
+    with trace_lock:
+        spans = trace_buffer.get(span['trace_id'])
+        if spans is None:
+            spans = trace_buffer[span['trace_id']] = []
+            while len(trace_buffer) > TRACE_BUFFER_TRACES:
+                trace_buffer.popitem(last=False)
+        spans.append(span)
+        if TRACE_EXPORT_PATH:
+            try:
+                with open(TRACE_EXPORT_PATH, 'a') as f:
+                    f.write(json.dumps(span, default=str) + "\n")
+            except OSError as e:
+                print(f"⚠️ Could not export span: {str(e)}")
+
+def new_span(name: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+    parent = current_span.get()
+    return {
+        'trace_id': parent['trace_id'] if parent else uuid.uuid4().hex,
+        'span_id': uuid.uuid4().hex[:16],
+        'parent_id': parent['span_id'] if parent else None,
+        'name': name,
+        'start': datetime.now().isoformat(),
+        'duration_ms': None,
+        'thread': threading.current_thread().name,
+        'status': 'ok',
+        'attributes': attributes
+    }
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """Nested span around a block; child of the current span, or the root of a new trace"""
+    span = new_span(name, attributes)
+    token = current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span['status'] = 'error'
+        span['error'] = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        span['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        current_span.reset(token)
+        export_span(span)
+
+def record_span(name: str, duration_seconds: float, **attributes):
+    """Record an already measured child span (for work spread over several calls)"""
+    if current_span.get() is None:
+        return
+    span = new_span(name, attributes)
+    span['duration_ms'] = round(duration_seconds * 1000, 3)
+    export_span(span)
+
+def traced(name: str, func):
+    """Wrap a callable so every call runs in its own span"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with trace_span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+class TracingMiddleware:
+    """Root span for every HTTP request; the trace id is returned in X-Trace-Id"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(TRACE_SKIP_PATHS):
+            await self.app(scope, receive, send)
+            return
+        
+        with trace_span('http.request', method=scope["method"], path=scope["path"]) as span:
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    span['attributes']['status_code'] = message["status"]
+                    headers = list(message.get("headers", [])) + [(b"x-trace-id", span['trace_id'].encode())]
+                    message = dict(message, headers=headers)
+                await send(message)
+            
+            await self.app(scope, receive, send_with_trace_id)
+
+class DecompressedReceive:
+    """ASGI receive wrapper that inflates each body chunk as it arrives.
+
+    Output is produced in bounded steps and counted against the size cap, so a
+    compression bomb is rejected before it is expanded in memory.
+    """
+
+    def __init__(self, receive, encoding: str, max_size: int):
+        self.receive = receive
+        self.encoding = encoding
+        self.max_size = max_size
+        self.total = 0
+        self.compressed = 0
+        self.seconds = 0.0
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def _check_size(self, size: int):
+        self.total += size
+        if self.total > self.max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Decompressed request body exceeds {self.max_size} bytes"
+            )
+
+    def _inflate(self, data: bytes) -> bytes:
+        parts = []
+        if self.encoding == "gzip":
+            while data:
+                part = self.decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES)
+                self._check_size(len(part))
+                parts.append(part)
+                data = self.decompressor.unconsumed_tail
+        else:
+            for offset in range(0, len(data), ZSTD_INPUT_STEP_BYTES):
+                part = self.decompressor.decompress(data[offset:offset + ZSTD_INPUT_STEP_BYTES])
+                self._check_size(len(part))
+                parts.append(part)
+        return b"".join(parts)
+
+    async def __call__(self):
+        message = await self.receive()
+        if message["type"] != "http.request":
+            return message
+        
+        more_body = message.get("more_body", False)
+        start = time.perf_counter()
+        try:
+            self.compressed += len(message.get("body", b""))
+            body = self._inflate(message.get("body", b""))
+            if not more_body:
+                if self.encoding == "gzip":
+                    tail = self.decompressor.flush()
+                    self._check_size(len(tail))
+                    body += tail
+                if not self.decompressor.eof:
+                    raise HTTPException(status_code=400, detail=f"Truncated {self.encoding} request body")
+        except DECOMPRESS_ERRORS as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {self.encoding} request body: {str(e)}")
+        finally:
+            self.seconds += time.perf_counter() - start
+        
+        if not more_body:
+            record_span('decode_body', self.seconds, encoding=self.encoding,
+                        compressed_bytes=self.compressed, decoded_bytes=self.total)
+        return {"type": "http.request", "body": body, "more_body": more_body}
+
+class DecompressRequestMiddleware:
+    """Accept gzip/zstd encoded request bodies and hand the app the decoded stream"""
+
+    def __init__(self, app, max_size: int = MAX_DECOMPRESSED_BODY_BYTES):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        encoding = ""
+        headers = []
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.decode("latin-1").strip().lower()
+            elif name != b"content-length":
+                headers.append((name, value))
+        
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+        
+        if encoding not in ("gzip", "zstd") or (encoding == "zstd" and zstandard is None):
+            response = JSONResponse(
+                status_code=415,
+                content={"detail": f"Unsupported Content-Encoding: {encoding}"}
+            )
+            await response(scope, receive, send)
+            return
+        
+        scope = dict(scope, headers=headers)
+        await self.app(scope, DecompressedReceive(receive, encoding, self.max_size), send)
 
-app = FastAPI(title="Agno AI JSON to XLSX Processing API", version="2.1.0")
+app.add_middleware(DecompressRequestMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -38,11 +391,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
-# Global storage for temporary files
-temp_files = {}
-TEMP_DIR = tempfile.mkdtemp(prefix="agno_xlsx_")
+app.add_middleware(TracingMiddleware)
 
 class ProcessRequest(BaseModel):
     json_data: str
@@ -50,6 +402,7 @@ class ProcessRequest(BaseModel):
     description: Optional[str] = ""
     api_key: str
     model: Optional[str] = "gemini-2.0-flash"
+    normalization: Optional[str] = "flat"  # "flat" or "relational" (nested arrays become linked sheets)
 
 class ProcessResponse(BaseModel):
     success: bool
@@ -58,43 +411,504 @@ class ProcessResponse(BaseModel):
     download_url: Optional[str] = None
     ai_analysis: Optional[str] = None
     error: Optional[str] = None
+    diagnostics: Optional[Dict[str, Any]] = None
+
+class AppendRequest(BaseModel):
+    json_data: str
+
+class MergeDocument(BaseModel):
+    json_data: str
+    file_name: Optional[str] = "document"
+
+class MergeRequest(BaseModel):
+    documents: Optional[List[MergeDocument]] = None
+    file_ids: Optional[List[str]] = None
+    file_name: Optional[str] = "merged"
+
+class LLMTimeoutError(Exception):
+    """Raised when the agent did not answer within the request deadline"""
+
+class LLMProviderError(Exception):
+    """Raised when the model call itself failed; only these count against the circuit"""
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit for a model is open and the AI path is skipped"""
+
+class SheetRowLimitError(Exception):
+    """Raised when a sheet would exceed Excel's row or column limit"""
+
+class CircuitBreaker:
+    """Tracks recent outcomes per model and short-circuits calls during provider incidents.
+
+    A model's circuit opens once it sees CIRCUIT_FAILURE_THRESHOLD failures (errors,
+    timeouts or calls slower than CIRCUIT_SLOW_CALL_SECONDS) within the rolling window.
+    After CIRCUIT_OPEN_SECONDS a single probe request is let through (half-open);
+    its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _state(self, model: str):
+        if model not in self._models:
+            self._models[model] = {
+                'state': 'closed',
+                'failures': deque(),
+                'opened_at': None,
+                'probe_in_flight': False,
+                'probe_thread': None,
+                'last_latency': None,
+                'last_error': None
+            }
+        return self._models[model]
+
+    def _prune(self, state, now: float):
+        while state['failures'] and now - state['failures'][0] > CIRCUIT_WINDOW_SECONDS:
+            state['failures'].popleft()
+
+    def allow_request(self, model: str) -> bool:
+        """Return True if a call to the model may proceed"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            if state['state'] == 'closed':
+                return True
+            if state['state'] == 'open' and now - state['opened_at'] >= CIRCUIT_OPEN_SECONDS:
+                state['state'] = 'half_open'
+                state['probe_in_flight'] = False
+            if state['state'] == 'half_open' and not state['probe_in_flight']:
+                state['probe_in_flight'] = True
+                state['probe_thread'] = threading.get_ident()
+                return True
+            return False
+
+    def release_probe(self, model: str):
+        """Give up the half-open probe held by this thread if no outcome was recorded for it"""
+        with self._lock:
+            state = self._models.get(model)
+            if (state is not None and state['state'] == 'half_open' and state['probe_in_flight']
+                    and state['probe_thread'] == threading.get_ident()):
+                state['probe_in_flight'] = False
+
+    def is_open(self, model: str) -> bool:
+        """True while the circuit is open and not yet due for a probe (does not consume the probe)"""
+        with self._lock:
+            state = self._models.get(model)
+            if state is None or state['state'] != 'open':
+                return False
+            return time.monotonic() - state['opened_at'] < CIRCUIT_OPEN_SECONDS
+
+    def retry_after(self, model: str) -> float:
+        """Seconds until an open circuit lets a probe through"""
+        with self._lock:
+            state = self._state(model)
+            if state['state'] != 'open':
+                return 0.0
+            return max(0.0, CIRCUIT_OPEN_SECONDS - (time.monotonic() - state['opened_at']))
+
+    def record_success(self, model: str, latency: float):
+        if latency > CIRCUIT_SLOW_CALL_SECONDS:
+            self.record_failure(model, f"slow call ({latency:.1f}s)", latency)
+            return
+        with self._lock:
+            state = self._state(model)
+            state['last_latency'] = latency
+            if state['state'] != 'closed':
+                print(f"🟢 Circuit closed for model {model}")
+            state['state'] = 'closed'
+            state['probe_in_flight'] = False
+            state['failures'].clear()
+
+    def record_failure(self, model: str, error: str, latency: Optional[float] = None):
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            state['last_latency'] = latency
+            state['last_error'] = error
+            state['failures'].append(now)
+            self._prune(state, now)
+            if state['state'] == 'half_open' or len(state['failures']) >= CIRCUIT_FAILURE_THRESHOLD:
+                if state['state'] != 'open':
+                    print(f"🔴 Circuit opened for model {model}: {error}")
+                state['state'] = 'open'
+                state['opened_at'] = now
+                state['probe_in_flight'] = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for model, state in self._models.items():
+                self._prune(state, now)
+                result[model] = {
+                    'state': state['state'],
+                    'recent_failures': len(state['failures']),
+                    'last_latency_seconds': state['last_latency'],
+                    'last_error': state['last_error']
+                }
+            return result
+
+llm_breaker = CircuitBreaker()
+
+def available_memory_bytes() -> Optional[int]:
+    """Memory still available to this process (cgroup limit if set, else MemAvailable)"""
+    candidates = []
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                candidates.append(int(limit) - int(f.read().strip()))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    candidates.append(int(line.split()[1]) * 1024)
+                    break
+    except (OSError, ValueError):
+        pass
+    return min(candidates) if candidates else None
+
+class AdmissionLane:
+    """Bounded concurrency and a bounded wait queue for one class of work.
+
+    Requests beyond the queue, requests that wait longer than
+    ADMISSION_QUEUE_TIMEOUT_SECONDS and requests arriving without enough memory
+    headroom are rejected with 503 and a Retry-After estimate instead of piling up.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0  # EWMA of service time, for Retry-After
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(self.avg_seconds * backlog))
+
+    def _reject(self, detail: str):
+        self.rejected += 1
+        print(f"🚦 Rejected {self.name} request: {detail}")
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after())})
+
+    @asynccontextmanager
+    async def admit(self, input_bytes: int = 0):
+        available = available_memory_bytes()
+        required = ADMISSION_MIN_FREE_MEMORY_BYTES + input_bytes * ADMISSION_MEMORY_PER_INPUT_BYTE
+        if available is not None and available < required:
+            self._reject("Server busy: not enough free memory")
+        
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()  # A slot is free: no waiting
+        else:
+            if self.waiting >= self.max_queue:
+                self._reject(f"Server busy: {self.name} queue is full")
+            
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self._reject(f"Server busy: timed out waiting in {self.name} queue")
+            finally:
+                self.waiting -= 1
+        
+        self.active += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.monotonic() - start)
+            self.semaphore.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'rejected': self.rejected,
+            'avg_seconds': round(self.avg_seconds, 3)
+        }
+
+class TokenBucketLimiter:
+    """Per-key token bucket; keys are API key fingerprints, never the keys themselves"""
+
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}  # fingerprint -> (tokens, last_refill)
+
+    def acquire(self, key: str) -> float:
+        """Take a token; returns 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now)
+            if len(self.buckets) > self.max_keys:
+                # Drop buckets that have refilled completely; they carry no state
+                full_after = self.burst / self.rate if self.rate > 0 else float('inf')
+                for stale in [k for k, (_, t) in self.buckets.items() if now - t > full_after]:
+                    del self.buckets[stale]
+            return 0.0
+        
+        self.buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate if self.rate > 0 else float('inf')
+
+agent_lane = AdmissionLane('agent', AGENT_MAX_CONCURRENCY, AGENT_MAX_QUEUE)
+direct_lane = AdmissionLane('direct', DIRECT_MAX_CONCURRENCY, DIRECT_MAX_QUEUE)
+rate_limiter = TokenBucketLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
+def api_key_fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+def check_rate_limit(api_key: str):
+    """Raise 429 with Retry-After when this API key is over its request budget"""
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    wait_seconds = rate_limiter.acquire(api_key_fingerprint(api_key))
+    if wait_seconds > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded for this API key",
+            headers={"Retry-After": str(max(1, math.ceil(wait_seconds)))}
+        )
+
+def uses_direct_conversion(json_size: int, model: str, normalization: Optional[str] = "flat") -> bool:
+    """Whether a /process request will skip the agent (large input, relational layout or open circuit)"""
+    return (json_size > DIRECT_CONVERSION_MIN_CHARS
+            or normalization == "relational"
+            or llm_breaker.is_open(model))
+
+# Rolling window of finished request diagnostics, used to rank the heaviest requests
+request_metrics_log = deque(maxlen=REQUEST_METRICS_HISTORY)
+memory_tracking_lock = threading.Lock()
+memory_tracking = {'active': set(), 'starts': 0, 'sampler': None}
+memory_tracking_wakeup = threading.Event()
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def sample_memory():
+    """Background sampler that updates the RSS peak of every request being measured"""
+    while True:
+        memory_tracking_wakeup.wait()
+        rss = current_rss_bytes()
+        with memory_tracking_lock:
+            if not memory_tracking['active']:
+                memory_tracking_wakeup.clear()
+                continue
+            for metrics in memory_tracking['active']:
+                if rss is not None and rss > metrics._memory_peak:
+                    metrics._memory_peak = rss
+        time.sleep(MEMORY_SAMPLE_INTERVAL_SECONDS)
+
+# Request being measured, inherited by worker threads that run its agent attempts
+current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+class RequestMetrics:
+    """Resource accounting for one request: wall and CPU time per stage, memory and bytes.
+
+    CPU time is per-thread: each stage counts the thread time of the thread it runs
+    on, plus the thread time of agent worker threads started for the request, so
+    concurrent requests do not inflate each other. Stages that hand work to another
+    thread must run there (see `run_stage`).
+    
+    Memory is measured over the process, so it is only attributable to this request
+    when it ran alone; `memory_exclusive` says whether it did. With the default
+    AGNO_MEMORY_TRACKING=rss it is reported as `rss_growth_bytes`: how far RSS rose
+    above its level at the start. That is not the request's peak allocation, because
+    memory freed by earlier requests is reused without growing RSS. Only
+    AGNO_MEMORY_TRACKING=tracemalloc reports `peak_memory_bytes` (peak traced Python
+    allocations, at a large CPU cost).
+    """
+
+    def __init__(self, label: str, input_bytes: int):
+        self.label = label
+        self.input_bytes = input_bytes
+        self.stages = {}
+        self.prompt = None
+        self.started_at = datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_seconds = 0.0
+        self._cpu_lock = threading.Lock()
+        self._memory_baseline = None
+        self._memory_peak = 0
+        self._memory_exclusive = False
+        self._finished = None
+        
+        if MEMORY_TRACKING not in ("rss", "tracemalloc"):
+            return
+        
+        with memory_tracking_lock:
+            if MEMORY_TRACKING == "tracemalloc":
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                if not memory_tracking['active']:
+                    tracemalloc.reset_peak()
+                self._memory_baseline = tracemalloc.get_traced_memory()[0]
+            else:
+                self._memory_baseline = current_rss_bytes()
+                if self._memory_baseline is None:
+                    return
+                self._memory_peak = self._memory_baseline
+                if memory_tracking['sampler'] is None:
+                    memory_tracking['sampler'] = threading.Thread(target=sample_memory, daemon=True)
+                    memory_tracking['sampler'].start()
+            
+            self._memory_exclusive = not memory_tracking['active']
+            memory_tracking['active'].add(self)
+            memory_tracking['starts'] += 1
+            self._starts_seen = memory_tracking['starts']
+            memory_tracking_wakeup.set()
+
+    def add_cpu(self, seconds: float):
+        """Charge CPU time spent on another thread (agent attempts) to this request"""
+        with self._cpu_lock:
+            self._cpu_seconds += seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        wall_start = time.perf_counter()
+        thread_start = time.thread_time()
+        with self._cpu_lock:
+            charged_start = self._cpu_seconds
+        token = current_metrics.set(self)
+        try:
+            with trace_span(name):
+                yield
+        finally:
+            current_metrics.reset(token)
+            thread_cpu = time.thread_time() - thread_start
+            with self._cpu_lock:
+                other_threads_cpu = self._cpu_seconds - charged_start
+                self._cpu_seconds += thread_cpu
+            stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            stage['wall_seconds'] = round(stage['wall_seconds'] + time.perf_counter() - wall_start, 4)
+            stage['cpu_seconds'] = round(stage['cpu_seconds'] + thread_cpu + other_threads_cpu, 4)
+
+    def run_stage(self, name: str, func, *args):
+        """Run `func` as a stage on the calling thread (use with run_in_threadpool)"""
+        with self.stage(name):
+            return func(*args)
+
+    def finish(self, file_id: Optional[str] = None, output_path: Optional[str] = None) -> Dict[str, Any]:
+        """Stop measuring, record the request in the rolling log and return its diagnostics"""
+        if self._finished is not None:
+            return self._finished
+        
+        memory_delta = None
+        if self._memory_baseline is not None:
+            with memory_tracking_lock:
+                if MEMORY_TRACKING == "tracemalloc":
+                    peak = tracemalloc.get_traced_memory()[1]
+                else:
+                    peak = max(self._memory_peak, current_rss_bytes() or 0)
+                memory_delta = max(0, peak - self._memory_baseline)
+                if memory_tracking['starts'] != self._starts_seen:
+                    self._memory_exclusive = False
+                memory_tracking['active'].discard(self)
+        
+        output_bytes = None
+        if output_path and os.path.exists(output_path):
+            output_bytes = os.path.getsize(output_path)
+        
+        span = current_span.get()
+        self._finished = {
+            'file_id': file_id,
+            'trace_id': span['trace_id'] if span else None,
+            'label': self.label,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(time.perf_counter() - self._wall_start, 4),
+            'cpu_seconds': round(self._cpu_seconds, 4),
+            'peak_memory_bytes': memory_delta if MEMORY_TRACKING == "tracemalloc" else None,
+            'rss_growth_bytes': memory_delta if MEMORY_TRACKING == "rss" else None,
+            'memory_source': MEMORY_TRACKING if memory_delta is not None else None,
+            'memory_exclusive': self._memory_exclusive if memory_delta is not None else None,
+            'input_bytes': self.input_bytes,
+            'output_bytes': output_bytes,
+            'stages': self.stages,
+            'prompt': self.prompt or None
+        }
+        request_metrics_log.append(self._finished)
+        return self._finished
 
 def cleanup_expired_files():
     """Clean up files older than 1 hour"""
     current_time = datetime.now()
     expired_files = []
     
-    for file_id, file_info in temp_files.items():
+    for file_id, file_info in list(temp_files.items()):
         if current_time - file_info['created_at'] > timedelta(hours=1):
             expired_files.append(file_id)
     
     for file_id in expired_files:
-        file_path = temp_files[file_id]['path']
+        file_info = temp_files.get(file_id)
+        if file_info is None:
+            continue
+        file_path = file_info['path']
         if os.path.exists(file_path):
             try:
                 os.remove(file_path)
             except:
                 pass
+        remove_file_sidecars(file_info)
         if file_id in temp_files:
             del temp_files[file_id]
+        file_locks.pop(file_id, None)
+
+def remove_file_sidecars(file_info: Dict[str, Any]):
+    """Delete the append sidecar and cached preview stored next to a workbook"""
+    parts_dir = file_info.get('parts_dir')
+    if parts_dir and os.path.isdir(parts_dir):
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    preview_path = file_info['path'] + ".preview.json"
+    if os.path.exists(preview_path):
+        try:
+            os.remove(preview_path)
+        except OSError:
+            pass
 
-def create_agno_agent(api_key: str, model: str = "gemini-2.0-flash"):
+def create_agno_agent(api_key: str, model: str = "gemini-2.0-flash", work_dir: str = TEMP_DIR):
     """Create Agno agent for JSON to XLSX conversion"""
     
+    load_engines()
+    
     # Set environment variable
     os.environ["GOOGLE_API_KEY"] = api_key
     
+    python_tools = PythonTools(
+        run_code=True,
+        pip_install=True,
+        base_dir=Path(work_dir)
+    )
+    # Trace the generated code the agent executes
+    for function in getattr(python_tools, 'functions', {}).values():
+        function.entrypoint = traced(f"tool.{function.name}", function.entrypoint)
+    
     # Create agent with working directory set to temp dir
     agent = Agent(
         model=Gemini(
             id=model,
             api_key=api_key
         ),
-        tools=[PythonTools(
-            run_code=True,
-            pip_install=True,
-            base_dir=Path(TEMP_DIR)
-        )],
+        tools=[python_tools],
         show_tool_calls=True,
         instructions=[
             "You are an autonomous data processing AI specialist",
@@ -110,10 +924,435 @@ def create_agno_agent(api_key: str, model: str = "gemini-2.0-flash"):
     
     return agent
 
-def direct_json_to_excel(json_data: str, file_name: str):
+def run_agent_once(prompt: str, api_key: str, model: str, work_dir: str):
+    """Build a fresh agent and run a single prompt (executed on a worker thread)"""
+    cpu_start = time.thread_time()
+    try:
+        with trace_span('agent.create', model=model):
+            agent = create_agno_agent(api_key, model, work_dir)
+        with trace_span('agent.run', model=model, prompt_chars=len(prompt)):
+            try:
+                response = agent.run(prompt)
+            except RecursionError:
+                # Caused by the input, not the provider
+                raise
+            except Exception as e:
+                raise LLMProviderError(str(e)) from e
+        return response.content
+    finally:
+        # Charge this worker thread's CPU to the request that started the attempt
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.add_cpu(time.thread_time() - cpu_start)
+
+def run_agent_hedged(prompt: str, api_key: str, model: str, work_dir: str, timeout: float):
+    """Run the agent, optionally hedging with a second attempt, and wait at most `timeout` seconds.
+
+    Each attempt writes into its own subdirectory; only the winner's workbooks are
+    moved into `work_dir`, so a slower attempt can never leave a half-written file there.
+    """
+    end = time.monotonic() + timeout
+    attempt_dirs = {}
+    
+    def start_attempt():
+        attempt_dir = os.path.join(work_dir, f"attempt_{uuid.uuid4().hex[:8]}")
+        os.makedirs(attempt_dir)
+        # Each attempt runs in a copy of the caller's context so its spans join the request trace
+        future = llm_executor.submit(contextvars.copy_context().run, run_agent_once, prompt, api_key, model, attempt_dir)
+        attempt_dirs[future] = attempt_dir
+        return future
+    
+    futures = [start_attempt()]
+    
+    if 0 < LLM_HEDGE_AFTER_SECONDS < timeout:
+        done, _ = wait(futures, timeout=LLM_HEDGE_AFTER_SECONDS)
+        if not done:
+            print(f"🔀 No answer after {LLM_HEDGE_AFTER_SECONDS}s, sending hedged request")
+            futures.append(start_attempt())
+    
+    pending = set(futures)
+    last_error = None
+    while pending:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                attempt_dir = attempt_dirs[future]
+                for path in glob.glob(os.path.join(attempt_dir, "*.xlsx")):
+                    os.replace(path, os.path.join(work_dir, os.path.basename(path)))
+                shutil.rmtree(attempt_dir, ignore_errors=True)
+                return future.result()
+            last_error = future.exception()
+    
+    if pending:
+        # Running threads cannot be interrupted; their results are discarded
+        for future in pending:
+            future.cancel()
+        raise LLMTimeoutError(f"LLM did not respond within {timeout:.1f}s")
+    raise last_error
+
+def run_agent_with_deadline(prompt: str, api_key: str, model: str, work_dir: str = TEMP_DIR):
+    """Run the agent under the per-request deadline with limited retries and circuit breaking"""
+    if not llm_breaker.allow_request(model):
+        raise CircuitOpenError(
+            f"AI circuit open for model {model}, retry in {llm_breaker.retry_after(model):.0f}s"
+        )
+    
+    deadline = time.monotonic() + LLM_TIMEOUT_SECONDS
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            start = time.monotonic()
+            try:
+                with trace_span('agent.attempt', attempt=attempt, model=model):
+                    content = run_agent_hedged(prompt, api_key, model, work_dir, deadline - start)
+                llm_breaker.record_success(model, time.monotonic() - start)
+                return content
+            except LLMTimeoutError as e:
+                llm_breaker.record_failure(model, str(e), time.monotonic() - start)
+                raise
+            except LLMProviderError as e:
+                llm_breaker.record_failure(model, str(e), time.monotonic() - start)
+                backoff = LLM_RETRY_BACKOFF_SECONDS * attempt
+                if attempt > LLM_MAX_RETRIES or time.monotonic() + backoff >= deadline:
+                    raise
+                if not llm_breaker.allow_request(model):
+                    raise CircuitOpenError(f"AI circuit opened for model {model} after: {str(e)}")
+                print(f"🔁 Agent attempt {attempt} failed ({str(e)}), retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+    finally:
+        # A probe that ended without an outcome (e.g. a local error building the agent) must not block the circuit
+        llm_breaker.release_probe(model)
+
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+SIDECAR_CHUNK_ROWS = 50000
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+# Relational normalization: generated keys linking child sheets to their parent rows
+NORMALIZATION_MODES = ("flat", "relational")
+RELATION_ID_COLUMN = "_row_id"
+RELATION_PARENT_COLUMN = "_parent_row_id"
+# Only text that a number writes back identically: no sign prefix, leading/trailing zeros or exponent
+LOSSLESS_NUMBER = re.compile(r"^-?(?:[1-9]\d*|0(?=\.))(?:\.\d*[1-9])?$|^0$")
+# Dates Excel's 1900 date system can represent
+EXCEL_MIN_DATE = datetime(1900, 1, 1)
+EXCEL_MAX_DATE = datetime(9999, 12, 31, 23, 59, 59)
+ISO_DATE_PREFIX = re.compile(r"^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$")
+ISO_UTC_OFFSET = re.compile(r"\d{2}:\d{2}(:\d{2}(\.\d+)?)?[+-]\d{2}:?\d{2}$")
+
+def safe_sheet_name(name: str, used: set) -> str:
+    """Excel-safe, unique sheet name (31 chars, no []:*?/\\)"""
+    base = INVALID_SHEET_CHARS.sub("_", str(name)).strip("'") or "Sheet"
+    candidate = base[:31]
+    counter = 2
+    while candidate.lower() in used:
+        suffix = f"_{counter}"
+        candidate = base[:31 - len(suffix)] + suffix
+        counter += 1
+    used.add(candidate.lower())
+    return candidate
+
+def convert_text_column(values):
+    """Typed version of a column of strings, or None if it should stay text"""
+    # Reject on a small sample first so free-text columns are not scanned in full
+    for candidate in (values.iloc[:TYPE_SAMPLE_SIZE], values):
+        lowered = candidate.str.strip().str.lower()
+        if lowered.isin(('true', 'false')).all():
+            if len(candidate) == len(values):
+                return lowered == 'true'
+            continue
+        
+        if candidate.str.match(LOSSLESS_NUMBER).all():
+            numbers = pd.to_numeric(candidate, errors='coerce')
+            # Keep identifiers that Excel would round (more than 15 significant digits)
+            if numbers.notna().all() and not (candidate.str.count(r"\d") > 15).any():
+                if len(candidate) == len(values):
+                    return numbers
+                continue
+        
+        # Excel has no time zones: only offset-free or all-UTC ("Z") columns keep their wall
+        # time when stored as datetimes; explicit offsets stay text so nothing is shifted
+        utc_suffix = candidate.str.endswith('Z')
+        if (candidate.str.match(ISO_DATE_PREFIX).all()
+                and not candidate.str.contains(ISO_UTC_OFFSET).any()
+                and (utc_suffix.all() or not utc_suffix.any())):
+            dates = pd.to_datetime(candidate, format='ISO8601', errors='coerce', utc=True).dt.tz_localize(None)
+            if dates.notna().all() and dates.min() >= EXCEL_MIN_DATE and dates.max() <= EXCEL_MAX_DATE:
+                if len(candidate) == len(values):
+                    return dates
+                continue
+        
+        return None
+    
+    return None
+
+def encode_column_types(df):
+    """Typing stage before writing: numeric, boolean, datetime and low-cardinality categorical columns.
+
+    json_normalize leaves most extracted values as generic objects. Converting them
+    lets the writer emit native Excel numbers/booleans/dates. Categorical columns only
+    save the per-cell str() conversion: both writers already de-duplicate shared strings.
+    
+    This does not make files smaller. The sheet XML shrinks, but the zipped workbook
+    ends up about the same size as plain pandas/openpyxl output, and about 2% larger
+    when there are near-unique text columns (their shared-string indexes compress
+    worse than inline text).
+    """
+    for column in df.columns:
+        series = df[column]
+        
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            df[column] = series.dt.tz_convert('UTC').dt.tz_localize(None)
+            continue
+        if series.dtype != object and not isinstance(series.dtype, pd.StringDtype):
+            continue
+        
+        values = series.dropna()
+        if values.empty:
+            continue
+        
+        value_types = set(map(type, values))
+        if value_types == {bool}:
+            df[column] = series.astype('boolean')
+            continue
+        if value_types != {str}:
+            continue
+        
+        converted = convert_text_column(values)
+        if converted is not None:
+            if converted.dtype == bool:
+                converted = converted.astype('boolean')
+            df[column] = converted.reindex(series.index)
+            continue
+        
+        unique_count = values.nunique()
+        if unique_count <= CATEGORY_MAX_UNIQUE and unique_count <= len(values) * CATEGORY_MAX_UNIQUE_RATIO:
+            df[column] = series.astype('category')
+    
+    return df
+
+def build_sheet_frames(data) -> List[tuple]:
+    """Split parsed JSON into (sheet_name, DataFrame) pairs, one per sheet"""
+    frames = []
+    used_names = set()
+    
+    if isinstance(data, list):
+        # If it's a list of objects, create a DataFrame directly
+        frames.append((safe_sheet_name('Data', used_names), pd.json_normalize(data)))
+    elif isinstance(data, dict):
+        # If it's a dict with multiple keys, create multiple sheets
+        summary = {}
+        for key, value in data.items():
+            if isinstance(value, list):
+                frames.append((safe_sheet_name(key, used_names), pd.json_normalize(value)))
+            elif isinstance(value, dict):
+                frames.append((safe_sheet_name(key, used_names), pd.json_normalize([value])))
+            else:
+                summary[key] = value
+        if summary:
+            # Top-level single values share one summary row
+            frames.append((safe_sheet_name('Summary', used_names), pd.DataFrame([summary])))
+    else:
+        # Single value
+        frames.append((safe_sheet_name('Data', used_names), pd.DataFrame([{'value': data}])))
+    
+    return frames
+
+def build_relational_frames(data) -> List[tuple]:
+    """Split parsed JSON into linked sheets: every nested array becomes its own child sheet.
+
+    Objects are flattened into dotted columns as in flat mode, but arrays are never
+    stringified or exploded in place. Each element becomes one row of a child sheet
+    (named by its dotted path) with a generated `_row_id` and the `_parent_row_id` of
+    the row it came from. Every value is visited once and lands in one cell, so memory
+    and output grow linearly with the input. Sheet names are cut to Excel's 31
+    characters, so a `Relations` sheet maps each sheet to its full path and parent sheet.
+    """
+    tables = {}  # table path -> rows, parents always created before their children
+    parents = {}  # table path -> parent table path (None for top-level tables)
+    pending = deque()
+    
+    def add_rows(path: str, items: list, parent_id: Optional[int], parent_path: Optional[str] = None):
+        parents.setdefault(path, parent_path)
+        rows = tables.setdefault(path, [])
+        for item in items:
+            row = {RELATION_ID_COLUMN: len(rows) + 1}
+            if parent_id is not None:
+                row[RELATION_PARENT_COLUMN] = parent_id
+            rows.append(row)
+            pending.append((path, row, item if isinstance(item, dict) else {'value': item}))
+    
+    def flatten(path: str, row: Dict[str, Any], node: Dict[str, Any], prefix: str = ""):
+        for key, value in node.items():
+            column = f"{prefix}{key}"
+            if isinstance(value, dict):
+                flatten(path, row, value, f"{column}.")
+            elif isinstance(value, list):
+                add_rows(f"{path}.{column}", value, row[RELATION_ID_COLUMN], path)
+            else:
+                if column in (RELATION_ID_COLUMN, RELATION_PARENT_COLUMN):
+                    # Keep source fields that clash with the generated keys
+                    column = f"{column}_source"
+                row[column] = value
+    
+    summary = {}
+    if isinstance(data, list):
+        add_rows('Data', data, None)
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, list):
+                add_rows(str(key), value, None)
+            elif isinstance(value, dict):
+                add_rows(str(key), [value], None)
+            else:
+                summary[key] = value
+    else:
+        add_rows('Data', [data], None)
+    
+    # Breadth-first, so child rows follow the order of their parents
+    while pending:
+        path, row, node = pending.popleft()
+        flatten(path, row, node)
+    
+    frames = []
+    used_names = set()
+    # Reserve the index sheet's name so no data sheet takes it
+    has_children = any(parent is not None for parent in parents.values())
+    relations_name = safe_sheet_name('Relations', used_names) if has_children else None
+    sheet_names = {}
+    relations = []
+    for path, rows in tables.items():
+        sheet_names[path] = safe_sheet_name(path, used_names)
+        frames.append((sheet_names[path], pd.DataFrame.from_records(rows)))
+        parent = parents[path]
+        relations.append({
+            'sheet': sheet_names[path],
+            'path': path,
+            'parent_sheet': sheet_names[parent] if parent is not None else None,
+            'rows': len(rows)
+        })
+    if summary:
+        # Top-level single values share one summary row
+        frames.append((safe_sheet_name('Summary', used_names), pd.DataFrame([summary])))
+    if has_children:
+        # `_parent_row_id` values refer to `_row_id` in the parent sheet
+        frames.append((relations_name, pd.DataFrame(relations, columns=['sheet', 'path', 'parent_sheet', 'rows'])))
+    
+    return frames
+
+def write_frame_xlsxwriter(workbook, worksheet, df, formats: Dict[str, Any]):
+    """Write a type-encoded DataFrame column by column with xlsxwriter's typed cell writers.
+
+    Skips pandas' per-cell formatter; categorical columns are written from their
+    codes so each distinct string is only converted once.
+    """
+    for col_idx, column in enumerate(df.columns):
+        worksheet.write_string(0, col_idx, str(column), formats['header'])
+    
+    for col_idx, column in enumerate(df.columns):
+        series = df[column]
+        dtype = series.dtype
+        
+        if isinstance(dtype, pd.CategoricalDtype):
+            categories = [str(value) for value in dtype.categories]
+            for row, code in enumerate(series.cat.codes.tolist(), 1):
+                if code >= 0:
+                    worksheet.write_string(row, col_idx, categories[code])
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            for row, value in enumerate(series.tolist(), 1):
+                if value is not None and value == value:
+                    worksheet.write_datetime(row, col_idx, value.to_pydatetime(), formats['datetime'])
+        elif pd.api.types.is_bool_dtype(dtype):
+            for row, value in enumerate(series.astype(object).tolist(), 1):
+                if value is not pd.NA and value is not None:
+                    worksheet.write_boolean(row, col_idx, bool(value))
+        elif pd.api.types.is_numeric_dtype(dtype):
+            for row, value in enumerate(series.tolist(), 1):
+                if value == value and value not in (float('inf'), float('-inf')):
+                    worksheet.write_number(row, col_idx, value)
+        else:
+            for row, value in enumerate(series.tolist(), 1):
+                if isinstance(value, str):
+                    worksheet.write_string(row, col_idx, value)
+                elif value is None or value is pd.NA or (isinstance(value, float) and value != value):
+                    continue
+                else:
+                    # Mixed/nested values: same text pandas would write
+                    worksheet.write(row, col_idx, value if isinstance(value, (bool, int, float)) else str(value))
+
+def check_sheet_size(sheet_name: str, rows: int, columns: int):
+    """Raise before writing a sheet Excel cannot hold (header row included)"""
+    if rows + 1 > EXCEL_MAX_ROWS:
+        raise SheetRowLimitError(f"Sheet '{sheet_name}' exceeds Excel's {EXCEL_MAX_ROWS} row limit")
+    if columns > EXCEL_MAX_COLUMNS:
+        raise SheetRowLimitError(f"Sheet '{sheet_name}' exceeds Excel's {EXCEL_MAX_COLUMNS} column limit")
+
+def write_sheet_frames(file_path: str, frames: List[tuple], parts_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Type-encode each frame, write it to its own sheet and return the workbook preview.
+
+    With `parts_dir`, the encoded frames are also stored as the append sidecar, so a
+    later append never has to read the workbook back.
+    """
+    manifest = {'sheets': {}, 'next_chunk': 0}
+    if parts_dir:
+        os.makedirs(parts_dir, exist_ok=True)
+    
+    # xlsxwriter silently skips cells past the limits, so refuse up front
+    for sheet_name, df in frames:
+        check_sheet_size(sheet_name, len(df), len(df.columns))
+    
+    preview_sheets = []
+    if EXCEL_ENGINE == 'xlsxwriter':
+        import xlsxwriter
+        
+        # Plain cells only, matching openpyxl output (no auto hyperlinks/formulas)
+        workbook = xlsxwriter.Workbook(file_path, {
+            'strings_to_urls': False,
+            'strings_to_formulas': False,
+            'strings_to_numbers': False
+        })
+        formats = {
+            'header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+            'datetime': workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        }
+        try:
+            for sheet_name, df in frames:
+                with trace_span('encode_column_types', sheet=sheet_name, rows=len(df), columns=len(df.columns)):
+                    df = encode_column_types(df)
+                preview_sheets.append(frame_preview(sheet_name, df))
+                with trace_span('write_sheet', sheet=sheet_name):
+                    write_frame_xlsxwriter(workbook, workbook.add_worksheet(sheet_name), df, formats)
+                if parts_dir:
+                    append_chunk(parts_dir, manifest, sheet_name, df)
+        finally:
+            with trace_span('workbook.close'):
+                workbook.close()
+    else:
+        with pd.ExcelWriter(file_path, engine='openpyxl', datetime_format='yyyy-mm-dd hh:mm:ss') as writer:
+            for sheet_name, df in frames:
+                df = encode_column_types(df)
+                preview_sheets.append(frame_preview(sheet_name, df))
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+                if parts_dir:
+                    append_chunk(parts_dir, manifest, sheet_name, df)
+    
+    if parts_dir:
+        save_manifest(parts_dir, manifest)
+    return {'sheets': preview_sheets}
+
+def direct_json_to_excel(json_data: str, file_name: str, normalization: str = "flat"):
     """Direct conversion of JSON to Excel without AI (fallback)"""
     try:
-        data = json.loads(json_data)
+        load_engines()
+        
+        with trace_span('json.loads', chars=len(json_data)):
+            data = json.loads(json_data)
         
         # Generate file info
         file_id = str(uuid.uuid4())
@@ -122,60 +1361,518 @@ def direct_json_to_excel(json_data: str, file_name: str):
         file_path = os.path.join(TEMP_DIR, f"{file_id}_{xlsx_filename}")
         
         # Handle different JSON structures
-        if isinstance(data, list):
-            # If it's a list of objects, create a DataFrame directly
-            df = pd.json_normalize(data)
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Data', index=False)
-        elif isinstance(data, dict):
-            # If it's a dict with multiple keys, create multiple sheets
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                for key, value in data.items():
-                    if isinstance(value, list):
-                        df = pd.json_normalize(value)
-                        sheet_name = str(key)[:31]  # Excel sheet name limit
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    elif isinstance(value, dict):
-                        df = pd.json_normalize([value])
-                        sheet_name = str(key)[:31]
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    else:
-                        # Single value
-                        df = pd.DataFrame([{key: value}])
-                        df.to_excel(writer, sheet_name='Summary', index=False)
-        else:
-            # Single value
-            df = pd.DataFrame([{'value': data}])
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Data', index=False)
+        with trace_span('build_sheet_frames', normalization=normalization):
+            if normalization == "relational":
+                frames = build_relational_frames(data)
+            else:
+                frames = build_sheet_frames(data)
+        # Relational workbooks cannot be appended to, so they skip the sidecar
+        parts_dir = file_path + ".parts" if normalization != "relational" else None
+        with trace_span('write_workbook', engine=EXCEL_ENGINE, sheets=len(frames)):
+            preview = write_sheet_frames(file_path, frames, parts_dir)
+        save_preview(file_path, preview)
         
         return file_id, xlsx_filename, file_path
         
     except Exception as e:
         raise Exception(f"Direct conversion failed: {str(e)}")
 
-def convert_json_with_agno(json_data: str, file_name: str, description: str, api_key: str, model: str):
+def get_file_lock(file_id: str) -> threading.Lock:
+    with file_locks_guard:
+        return file_locks.setdefault(file_id, threading.Lock())
+
+def save_manifest(parts_dir: str, manifest: Dict[str, Any]):
+    manifest_path = os.path.join(parts_dir, "manifest.json")
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def load_manifest(parts_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(parts_dir, "manifest.json")) as f:
+        return json.load(f)
+
+def append_chunk(parts_dir: str, manifest: Dict[str, Any], sheet_name: str, df) -> int:
+    """Store one type-encoded chunk for a sheet and extend its column list"""
+    sheet = manifest['sheets'].setdefault(sheet_name, {'columns': [], 'rows': 0, 'chunks': []})
+    known_columns = set(sheet['columns'])
+    sheet['columns'].extend(str(c) for c in df.columns if str(c) not in known_columns)
+    
+    if len(df) == 0:
+        return 0
+    
+    chunk_name = f"chunk_{manifest['next_chunk']:06d}.pkl"
+    manifest['next_chunk'] += 1
+    df.columns = [str(c) for c in df.columns]
+    df.to_pickle(os.path.join(parts_dir, chunk_name))
+    sheet['chunks'].append(chunk_name)
+    sheet['rows'] += len(df)
+    return len(df)
+
+def seed_sidecar(file_info: Dict[str, Any]) -> str:
+    """Build the columnar sidecar of an agent-generated workbook (one read, on first append).
+
+    Direct conversions and merges write their sidecar while generating the workbook.
+    """
+    parts_dir = file_info['path'] + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    manifest = {'sheets': {}, 'next_chunk': 0}
+    
+    for sheet_name, df in pd.read_excel(file_info['path'], sheet_name=None).items():
+        append_chunk(parts_dir, manifest, sheet_name, df)
+    
+    save_manifest(parts_dir, manifest)
+    file_info['parts_dir'] = parts_dir
+    return parts_dir
+
+def append_to_workbook(file_id: str, json_data: str) -> Dict[str, int]:
+    """Append records to an existing workbook's sheets without rewriting the workbook.
+
+    New records are normalized the same way as direct conversion, matched to
+    sheets by name (new keys extend the columns, new record types add sheets)
+    and stored as a new chunk; the XLSX is rebuilt lazily on the next download.
+    """
+    load_engines()
+    data = json.loads(json_data)
+    file_info = temp_files[file_id]
+    
+    with get_file_lock(file_id):
+        parts_dir = file_info.get('parts_dir') or seed_sidecar(file_info)
+        manifest = load_manifest(parts_dir)
+        sheet_names = {name.lower(): name for name in manifest['sheets']}
+        
+        appended = {}
+        for sheet_name, df in build_sheet_frames(data):
+            target = sheet_names.get(sheet_name.lower())
+            if target is None:
+                target = safe_sheet_name(sheet_name, set(sheet_names))
+                sheet_names[target.lower()] = target
+            appended[target] = append_chunk(parts_dir, manifest, target, encode_column_types(df))
+        
+        save_manifest(parts_dir, manifest)
+        file_info['dirty'] = True
+        save_preview(file_info['path'], sidecar_preview(parts_dir, manifest), file_info)
+    
+    return appended
+
+def materialize_workbook(file_id: str):
+    """Rewrite the XLSX from its sidecar if records were appended since the last write"""
+    file_info = temp_files[file_id]
+    
+    with get_file_lock(file_id):
+        if not file_info.get('dirty'):
+            return
+        
+        manifest = load_manifest(file_info['parts_dir'])
+        frames = []
+        for sheet_name, sheet in manifest['sheets'].items():
+            chunks = [pd.read_pickle(os.path.join(file_info['parts_dir'], name)) for name in sheet['chunks']]
+            df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+            frames.append((sheet_name, df.reindex(columns=sheet['columns'])))
+        
+        # Keep the .xlsx suffix: pandas picks (and validates) the writer engine by extension
+        tmp_path = file_info['path'] + ".tmp.xlsx"
+        preview = write_sheet_frames(tmp_path, frames)
+        os.replace(tmp_path, file_info['path'])
+        save_preview(file_info['path'], preview, file_info)
+        file_info['dirty'] = False
+
+
+def excel_cell_value(value):
+    """Plain Python value for a streamed cell (None for missing, text for nested values)"""
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        value = value.item()  # numpy scalar
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float):
+        return None if value != value or value in (float('inf'), float('-inf')) else value
+    if isinstance(value, (bool, int, str, datetime)):
+        return value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+    return str(value)
+
+def preview_value(value):
+    """JSON-safe version of a cell value for previews"""
+    value = excel_cell_value(value)
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def frame_preview(sheet_name: str, df, max_rows: int = PREVIEW_ROWS) -> Dict[str, Any]:
+    return {
+        'name': sheet_name,
+        'columns': [str(c) for c in df.columns],
+        'row_count': len(df),
+        'rows': [[preview_value(v) for v in row] for row in df.head(max_rows).itertuples(index=False, name=None)]
+    }
+
+def sidecar_preview(parts_dir: str, manifest: Dict[str, Any], max_rows: int = PREVIEW_ROWS) -> Dict[str, Any]:
+    """Preview of an appended workbook from its sidecar; reads only the chunks needed for the first rows"""
+    sheets = []
+    for sheet_name, sheet in manifest['sheets'].items():
+        rows = []
+        for chunk_name in sheet['chunks']:
+            if len(rows) >= max_rows:
+                break
+            chunk = pd.read_pickle(os.path.join(parts_dir, chunk_name)).reindex(columns=sheet['columns'])
+            rows.extend([preview_value(v) for v in row] for row in chunk.head(max_rows - len(rows)).itertuples(index=False, name=None))
+        sheets.append({'name': sheet_name, 'columns': sheet['columns'], 'row_count': sheet['rows'], 'rows': rows})
+    return {'sheets': sheets}
+
+def workbook_preview(file_path: str, max_rows: int = PREVIEW_ROWS) -> Dict[str, Any]:
+    """Preview of any workbook via openpyxl's read-only streaming reader (never loads the whole file)"""
+    import openpyxl
+    
+    sheets = []
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            row_iter = worksheet.iter_rows(values_only=True)
+            header = next(row_iter, None)
+            rows = [[preview_value(v) for v in row] for row in itertools.islice(row_iter, max_rows)]
+            if worksheet.max_row is not None:
+                row_count = max(0, worksheet.max_row - 1)
+            else:
+                # No dimension record: count the remaining rows while streaming
+                row_count = len(rows) + sum(1 for _ in row_iter)
+            sheets.append({
+                'name': worksheet.title,
+                'columns': [str(c) if c is not None else "" for c in header] if header else [],
+                'row_count': row_count,
+                'rows': rows
+            })
+    finally:
+        workbook.close()
+    return {'sheets': sheets}
+
+def save_preview(file_path: str, preview: Dict[str, Any], file_info: Optional[Dict[str, Any]] = None):
+    """Cache a preview next to the workbook (and in memory when the file is registered)"""
+    preview['generated_at'] = datetime.now().isoformat()
+    with open(file_path + ".preview.json.tmp", 'w') as f:
+        json.dump(preview, f, default=str)
+    os.replace(file_path + ".preview.json.tmp", file_path + ".preview.json")
+    if file_info is not None:
+        file_info['sheet_preview'] = preview
+
+def load_preview(file_id: str) -> Dict[str, Any]:
+    """Cached preview of a file, computing and caching it on first use"""
+    file_info = temp_files[file_id]
+    if file_info.get('sheet_preview') is not None:
+        return file_info['sheet_preview']
+    
+    preview_path = file_info['path'] + ".preview.json"
+    if os.path.exists(preview_path):
+        with open(preview_path) as f:
+            file_info['sheet_preview'] = json.load(f)
+        return file_info['sheet_preview']
+    
+    with get_file_lock(file_id):
+        with trace_span('workbook_preview'):
+            preview = workbook_preview(file_info['path'])
+        save_preview(file_info['path'], preview, file_info)
+    return preview
+
+class StreamingWorkbook:
+    """Row-at-a-time workbook writer with bounded memory.
+
+    Uses xlsxwriter in constant_memory mode (rows are flushed as soon as the next
+    row starts) or openpyxl's write-only mode when xlsxwriter is not installed.
+    Rows must be appended in order within each sheet; sheets can be interleaved.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.rows = {}
+        self.previews = {}
+        if EXCEL_ENGINE == 'xlsxwriter':
+            import xlsxwriter
+            self.workbook = xlsxwriter.Workbook(file_path, {
+                'constant_memory': True,
+                'strings_to_urls': False,
+                'strings_to_formulas': False,
+                'strings_to_numbers': False
+            })
+            self.datetime_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+            self.header_format = self.workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        else:
+            import openpyxl
+            self.workbook = openpyxl.Workbook(write_only=True)
+
+    def add_sheet(self, name: str, header: List[str]):
+        check_sheet_size(name, 0, len(header))
+        if EXCEL_ENGINE == 'xlsxwriter':
+            sheet = self.workbook.add_worksheet(name)
+            for col_idx, column in enumerate(header):
+                sheet.write_string(0, col_idx, column, self.header_format)
+        else:
+            sheet = self.workbook.create_sheet(name)
+            sheet.append(header)
+        self.rows[name] = 1
+        self.previews[name] = {'name': name, 'columns': list(header), 'row_count': 0, 'rows': []}
+        return sheet
+
+    def append_row(self, name: str, sheet, values):
+        row = self.rows[name]
+        if row >= EXCEL_MAX_ROWS:
+            raise SheetRowLimitError(f"Sheet '{name}' exceeds Excel's {EXCEL_MAX_ROWS} row limit")
+        
+        if EXCEL_ENGINE == 'xlsxwriter':
+            for col_idx, value in enumerate(values):
+                if value is None:
+                    continue
+                if isinstance(value, datetime):
+                    sheet.write_datetime(row, col_idx, value, self.datetime_format)
+                else:
+                    sheet.write(row, col_idx, value)
+        else:
+            sheet.append(values)
+        self.rows[name] = row + 1
+        
+        preview = self.previews[name]
+        preview['row_count'] += 1
+        if len(preview['rows']) < PREVIEW_ROWS:
+            preview['rows'].append([preview_value(v) for v in values])
+
+    def preview(self) -> Dict[str, Any]:
+        return {'sheets': list(self.previews.values())}
+
+    def close(self):
+        if EXCEL_ENGINE == 'xlsxwriter':
+            self.workbook.close()
+        else:
+            self.workbook.save(self.file_path)
+
+def iter_document_record_sets(json_data: str):
+    """(record_type, columns, rows) for each sheet a JSON document would produce"""
+    for record_type, df in build_sheet_frames(json.loads(json_data)):
+        df = encode_column_types(df)
+        yield record_type, [str(c) for c in df.columns], df.itertuples(index=False, name=None)
+
+def iter_file_record_sets(file_id: str):
+    """(record_type, columns, rows) for each sheet of an already generated workbook"""
+    file_info = temp_files[file_id]
+    
+    if file_info.get('parts_dir'):
+        # Appended data lives in the sidecar; read it chunk by chunk
+        with get_file_lock(file_id):
+            manifest = load_manifest(file_info['parts_dir'])
+        for record_type, sheet in manifest['sheets'].items():
+            columns = sheet['columns']
+            
+            def rows(sheet=sheet, columns=columns):
+                for chunk_name in sheet['chunks']:
+                    chunk = pd.read_pickle(os.path.join(file_info['parts_dir'], chunk_name))
+                    yield from chunk.reindex(columns=columns).itertuples(index=False, name=None)
+            
+            yield record_type, columns, rows()
+        return
+    
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_info['path'], read_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            row_iter = worksheet.iter_rows(values_only=True)
+            header = next(row_iter, None)
+            if header is None:
+                continue
+            yield worksheet.title, [str(c) if c is not None else "" for c in header], row_iter
+    finally:
+        workbook.close()
+
+def merge_into_workbook(sources: List[tuple], file_path: str) -> Dict[str, Any]:
+    """Merge many record sources into one workbook in a single pass: one sheet per record type.
+
+    `sources` is a list of (source_document, record_set_iterator_factory). Each input
+    is read once; its rows (with a leading `source_document` column) are staged as
+    columnar chunks of its record type's sheet in the append sidecar, which also
+    collects the union of columns. The workbook is then streamed from those chunks with
+    the final headers (streamed sheets cannot grow columns once their header is
+    written), plus a `Merge Summary` sheet listing what every input contributed.
+    Memory is bounded by one chunk of SIDECAR_CHUNK_ROWS rows.
+    """
+    parts_dir = file_path + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    manifest = {'sheets': {}, 'next_chunk': 0}
+    used_names = set()
+    summary_name = safe_sheet_name('Merge Summary', used_names)
+    summary_columns = ['source_document', 'record_type', 'sheet', 'rows', 'status']
+    # Registered first so the summary stays the first sheet when appends rebuild the workbook
+    manifest['sheets'][summary_name] = {'columns': summary_columns, 'rows': 0, 'chunks': []}
+    sheet_names = {}  # record_type -> sheet name
+    summary_rows = []
+    
+    for source_document, record_sets in sources:
+        try:
+            for record_type, columns, rows in record_sets():
+                name = sheet_names.get(record_type)
+                if name is None:
+                    name = sheet_names[record_type] = safe_sheet_name(record_type, used_names)
+                header = ['source_document'] + columns
+                
+                def flush(buffer):
+                    if manifest['sheets'].get(name, {'rows': 0})['rows'] + len(buffer) + 1 > EXCEL_MAX_ROWS:
+                        raise SheetRowLimitError(f"Sheet '{name}' exceeds Excel's {EXCEL_MAX_ROWS} row limit")
+                    append_chunk(parts_dir, manifest, name, pd.DataFrame(buffer, columns=header))
+                
+                buffer = []
+                row_count = 0
+                for row in rows:
+                    buffer.append((source_document,) + tuple(row))
+                    row_count += 1
+                    if len(buffer) >= SIDECAR_CHUNK_ROWS:
+                        flush(buffer)
+                        buffer = []
+                flush(buffer)
+                summary_rows.append([source_document, record_type, name, row_count, 'merged'])
+        except SheetRowLimitError:
+            raise
+        except Exception as e:
+            summary_rows.append([source_document, None, None, 0, f"skipped: {str(e)}"])
+    
+    append_chunk(parts_dir, manifest, summary_name, pd.DataFrame(summary_rows, columns=summary_columns))
+    
+    workbook = StreamingWorkbook(file_path)
+    try:
+        for name, sheet in manifest['sheets'].items():
+            worksheet = workbook.add_sheet(name, sheet['columns'])
+            for chunk_name in sheet['chunks']:
+                chunk = pd.read_pickle(os.path.join(parts_dir, chunk_name)).reindex(columns=sheet['columns'])
+                for row in chunk.itertuples(index=False, name=None):
+                    workbook.append_row(name, worksheet, [excel_cell_value(v) for v in row])
+    finally:
+        workbook.close()
+    
+    # The staged chunks double as the append sidecar of the merged workbook
+    save_manifest(parts_dir, manifest)
+    save_preview(file_path, workbook.preview())
+    
+    return {
+        'documents': len(sources),
+        'sheets': len(sheet_names),
+        'skipped': sum(1 for row in summary_rows if row[4] != 'merged')
+    }
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for prompt sizing (about 4 characters per token)"""
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+def tabulate_records(node):
+    """Turn every list of objects into {"$cols": [...], "$rows": [[...], ...]} so keys appear once"""
+    if isinstance(node, dict):
+        return {key: tabulate_records(value) for key, value in node.items()}
+    if isinstance(node, list):
+        if len(node) > 1 and all(isinstance(item, dict) for item in node):
+            columns = list(dict.fromkeys(key for item in node for key in item))
+            return {
+                "$cols": columns,
+                "$rows": [[tabulate_records(item.get(column)) for column in columns] for item in node]
+            }
+        return [tabulate_records(item) for item in node]
+    return node
+
+def count_long_strings(node, counts: Dict[str, int]) -> bool:
+    """Count long string values; returns False if any value could be mistaken for a reference"""
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, str):
+            if item.startswith(PROMPT_REF_MARKER):
+                return False
+            if len(item) >= PROMPT_REF_MIN_CHARS:
+                counts[item] = counts.get(item, 0) + 1
+    return True
+
+def replace_refs(node, refs: Dict[str, str]):
+    if isinstance(node, dict):
+        return {key: replace_refs(value, refs) for key, value in node.items()}
+    if isinstance(node, list):
+        return [replace_refs(item, refs) for item in node]
+    if isinstance(node, str):
+        return refs.get(node, node)
+    return node
+
+def compact_json_for_prompt(data) -> tuple:
+    """Encode parsed JSON for a prompt: minified, lists of objects as column tables,
+    long repeated strings moved to a "$refs" table. Returns (text, uses_tables, uses_refs)."""
+    tabulated = tabulate_records(data)
+    uses_tables = tabulated != data
+    
+    counts = {}
+    repeated = []
+    if count_long_strings(data, counts):
+        repeated = [value for value, count in counts.items() if count > 1]
+    
+    if repeated:
+        refs = {value: f"{PROMPT_REF_MARKER}{index}" for index, value in enumerate(repeated)}
+        tabulated = {"$refs": repeated, "data": replace_refs(tabulated, refs)}
+    
+    text = json.dumps(tabulated, separators=(',', ':'), ensure_ascii=False, default=str)
+    
+    # Tables and refs carry some overhead; tiny documents are shorter as plain minified JSON
+    minified = json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str)
+    if len(minified) <= len(text):
+        return minified, False, False
+    return text, uses_tables, bool(repeated)
+
+def describe_prompt_encoding(uses_tables: bool, uses_refs: bool) -> str:
+    """Prompt lines explaining the compact encoding to the agent"""
+    lines = ["The JSON below is minified."]
+    if uses_tables:
+        lines.append('Lists of objects are shown as {"$cols": [keys], "$rows": [[values in key order], ...]}; a null value may also mean the key was absent.')
+    if uses_refs:
+        lines.append(f'Repeated long strings are listed once in "$refs"; a value "{PROMPT_REF_MARKER}N" stands for $refs[N], and the document itself is under "data".')
+    lines.append("This view is for understanding the data only: load the exact original JSON from the file given below.")
+    return "\n            ".join(lines)
+
+def convert_json_with_agno(json_data: str, file_name: str, description: str, api_key: str, model: str,
+                           work_dir: str = TEMP_DIR, prompt_stats: Optional[Dict[str, Any]] = None):
     """Convert JSON to XLSX using Agno AI agent with better handling for large data"""
     
+    if llm_breaker.is_open(model):
+        # Skip the file write and prompt encoding; the caller converts directly
+        print(f"⏭️ AI circuit open for model {model}, using direct conversion")
+        return None
+    
     try:
         # Check JSON size
         json_size = len(json_data)
         print(f"📊 JSON data size: {json_size:,} characters")
         
         # For very large JSON (>100KB), use direct conversion
-        if json_size > 100000:
+        if json_size > DIRECT_CONVERSION_MIN_CHARS:
             print("⚡ Large JSON detected, using optimized direct conversion...")
             return None  # Signal to use direct conversion
         
-        # Create agent
-        agent = create_agno_agent(api_key, model)
+        # The agent always loads the exact data from a file, so the prompt only needs to show it
+        json_file_path = os.path.join(work_dir, f"temp_{uuid.uuid4()}.json")
+        with open(json_file_path, 'w') as f:
+            f.write(json_data)
         
-        # For medium-sized JSON (50KB-100KB), save to file first
-        if json_size > 50000:
-            json_file_path = os.path.join(TEMP_DIR, f"temp_{uuid.uuid4()}.json")
-            with open(json_file_path, 'w') as f:
-                f.write(json_data)
+        with trace_span("prompt.encode") as encode_span:
+            compact, uses_tables, uses_refs = compact_json_for_prompt(json.loads(json_data))
             
+            # Documents whose compact form is still too large are only referenced by path
+            inline = len(compact) <= PROMPT_INLINE_MAX_CHARS
+            raw_tokens = estimate_tokens(json_data)
+            encoded_tokens = estimate_tokens(compact)
+            stats = {
+                'mode': 'inline' if inline else 'file',
+                'raw_chars': json_size,
+                'encoded_chars': len(compact),
+                'estimated_raw_tokens': raw_tokens,
+                'estimated_encoded_tokens': encoded_tokens,
+                'estimated_tokens_saved': raw_tokens - encoded_tokens,
+                'tables': uses_tables,
+                'refs': uses_refs
+            }
+            if prompt_stats is not None:
+                prompt_stats.update(stats)
+            encode_span['attributes'].update(stats)
+        
+        print(f"🗜️ Prompt encoding: {json_size:,} -> {len(compact):,} chars "
+              f"(~{stats['estimated_tokens_saved']:,} tokens saved, {stats['mode']})")
+        
+        if not inline:
             prompt = f"""
             Convert the JSON data from file to a well-structured Excel file.
 
@@ -190,24 +1887,25 @@ def convert_json_with_agno(json_data: str, file_name: str, description: str, api
             3. Handle the data efficiently (use chunking if needed for large data)
             4. Create meaningful sheets and columns
             5. Save as {file_name}_processed.xlsx
-            6. Clean up the temporary JSON file after processing
 
             Write and execute Python code to accomplish this.
             """
         else:
-            # For smaller JSON, include in prompt
+            # For smaller JSON, include the compact encoding in the prompt
             prompt = f"""
-            Convert this JSON data to a well-structured Excel file:
+            Convert this JSON data to a well-structured Excel file.
+            {describe_prompt_encoding(uses_tables, uses_refs)}
 
             JSON Data:
-            {json_data}
+            {compact}
 
             File Info:
             - Base filename: {file_name}
             - Description: {description}
+            - JSON file path: {json_file_path}
 
             Instructions:
-            1. Analyze the JSON structure thoroughly
+            1. Analyze the JSON structure thoroughly and read the data from the file: {json_file_path}
             2. Decide the optimal Excel organization (sheets, columns, relationships)
             3. Write Python code to create the Excel file
             4. Use a descriptive filename based on the content
@@ -217,10 +1915,8 @@ def convert_json_with_agno(json_data: str, file_name: str, description: str, api
             Create the most logical and user-friendly Excel structure for this data.
             """
         
-        # Get response from agent
-        response = agent.run(prompt)
-        
-        return response.content
+        # Get response from agent, bounded by the LLM deadline
+        return run_agent_with_deadline(prompt, api_key, model, work_dir)
         
     except RecursionError as e:
         print(f"⚠️ RecursionError in Agno: {str(e)}")
@@ -235,188 +1931,360 @@ def periodic_cleanup():
         time.sleep(300)  # Clean up every 5 minutes
         cleanup_expired_files()
 
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
+def store_file_info(file_id: str, file_path: str, filename: str, json_data: str,
+                    diagnostics: Optional[Dict[str, Any]] = None, normalization: str = "flat"):
+    """Register a generated workbook so it can be listed and downloaded.
+
+    Called from worker threads: the entry is built first and published with a single
+    assignment, so readers never see it half-filled.
+    """
+    file_info = {
+        'path': file_path,
+        'filename': filename,
+        'created_at': datetime.now(),
+        'original_json': json_data[:500] + "..." if len(json_data) > 500 else json_data,
+        'diagnostics': diagnostics,
+        'normalization': normalization
+    }
+    # Direct conversions and merges store their append sidecar while writing the workbook
+    parts_dir = file_path + ".parts"
+    if os.path.exists(os.path.join(parts_dir, "manifest.json")):
+        file_info['parts_dir'] = parts_dir
+    temp_files[file_id] = file_info
 
 @app.post("/process", response_model=ProcessResponse)
 async def process_json_data(request: ProcessRequest):
     """Process JSON data and convert to XLSX using Agno AI or direct conversion"""
     
+    check_rate_limit(request.api_key)
+    
+    if request.normalization not in NORMALIZATION_MODES:
+        raise HTTPException(status_code=400, detail=f"'normalization' must be one of: {', '.join(NORMALIZATION_MODES)}")
+    
+    # Direct conversions get their own lane so they never wait behind slow agent runs
+    json_size = len(request.json_data)
+    lane = direct_lane if uses_direct_conversion(json_size, request.model, request.normalization) else agent_lane
+    
+    async with lane.admit(json_size):
+        return await run_in_threadpool(run_process_request, request)
+
+def run_process_request(request: ProcessRequest) -> ProcessResponse:
+    """Blocking part of /process, executed on a worker thread"""
+    
+    metrics = RequestMetrics(request.file_name, len(request.json_data.encode('utf-8')))
+    work_dir = None
+    
     try:
         print(f"📥 Processing request for file: {request.file_name}")
         
         # Validate JSON
-        try:
-            json.loads(request.json_data)
-        except json.JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+        with metrics.stage('validate'):
+            try:
+                json.loads(request.json_data)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
         
-        # Get files before processing
-        files_before = set(glob.glob(os.path.join(TEMP_DIR, "*.xlsx")))
+        # Each agent run gets its own directory so concurrent requests never pick up each other's files
+        work_dir = os.path.join(TEMP_DIR, f"run_{uuid.uuid4()}")
+        os.makedirs(work_dir)
+        files_before = set(glob.glob(os.path.join(work_dir, "*.xlsx")))
         
-        # Try to process with Agno AI
-        try:
-            ai_response = convert_json_with_agno(
-                request.json_data, 
-                request.file_name, 
-                request.description, 
-                request.api_key, 
-                request.model
-            )
+        if request.normalization == "relational":
+            # The sheet layout is fully specified, so no agent run is needed
+            ai_response = None
+            fallback_reason = "Direct conversion used for relational normalization"
+        else:
+            # Try to process with Agno AI
+            prompt_stats = {}
+            metrics.prompt = prompt_stats
+            try:
+                with metrics.stage('agent'):
+                    ai_response = convert_json_with_agno(
+                        request.json_data, 
+                        request.file_name, 
+                        request.description, 
+                        request.api_key, 
+                        request.model,
+                        work_dir,
+                        prompt_stats
+                    )
+                
+                if ai_response is None:
+                    # Agno signaled to use direct conversion
+                    print("📊 Using direct conversion for large/complex JSON...")
+                    if llm_breaker.is_open(request.model):
+                        fallback_reason = f"Direct conversion used, AI circuit open for model {request.model}"
+                    else:
+                        fallback_reason = "Direct conversion used for large JSON data"
+                else:
+                    print(f"🤖 AI Response: {ai_response[:200] if ai_response else 'No response'}...")
+                    fallback_reason = None
+                
+            except Exception as agno_error:
+                print(f"⚠️ Agno failed, using fallback: {str(agno_error)}")
+                ai_response = None
+                fallback_reason = f"Fallback conversion used due to: {str(agno_error)}"
+        
+        if fallback_reason is None:
+            # Find newly created Excel files (if Agno created them)
+            with metrics.stage('collect_output'):
+                files_after = set(glob.glob(os.path.join(work_dir, "*.xlsx")))
+                new_files = files_after - files_before
+                
+                if new_files:
+                    # Use the most recently created file
+                    newest_file = max(new_files, key=os.path.getmtime)
+                    
+                    # Generate file ID
+                    file_id = str(uuid.uuid4())
+                    original_filename = os.path.basename(newest_file)
+                    
+                    # Create managed filename
+                    managed_filename = f"{file_id}_{original_filename}"
+                    managed_path = os.path.join(TEMP_DIR, managed_filename)
+                    
+                    # Move file to managed location
+                    os.rename(newest_file, managed_path)
             
-            if ai_response is None:
-                # Agno signaled to use direct conversion
-                print("📊 Using direct conversion for large/complex JSON...")
-                file_id, xlsx_filename, file_path = direct_json_to_excel(
-                    request.json_data, 
-                    request.file_name
-                )
+            if new_files:
+                diagnostics = metrics.finish(file_id, managed_path)
+                store_file_info(file_id, managed_path, original_filename, request.json_data, diagnostics)
                 
-                # Store file info
-                temp_files[file_id] = {
-                    'path': file_path,
-                    'filename': xlsx_filename,
-                    'created_at': datetime.now(),
-                    'original_json': request.json_data[:500] + "..." if len(request.json_data) > 500 else request.json_data
-                }
+                print(f"✅ File created successfully: {original_filename}")
                 
                 return ProcessResponse(
                     success=True,
                     file_id=file_id,
-                    file_name=xlsx_filename,
+                    file_name=original_filename,
                     download_url=f"/download/{file_id}",
-                    ai_analysis="Direct conversion used for large JSON data"
+                    ai_analysis=ai_response,
+                    diagnostics=diagnostics
                 )
             
-            print(f"🤖 AI Response: {ai_response[:200] if ai_response else 'No response'}...")
-            
-        except Exception as agno_error:
-            print(f"⚠️ Agno failed, using fallback: {str(agno_error)}")
-            # Use direct conversion as fallback
-            file_id, xlsx_filename, file_path = direct_json_to_excel(
-                request.json_data, 
-                request.file_name
-            )
-            
-            # Store file info
-            temp_files[file_id] = {
-                'path': file_path,
-                'filename': xlsx_filename,
-                'created_at': datetime.now(),
-                'original_json': request.json_data[:500] + "..." if len(request.json_data) > 500 else request.json_data
-            }
-            
-            return ProcessResponse(
-                success=True,
-                file_id=file_id,
-                file_name=xlsx_filename,
-                download_url=f"/download/{file_id}",
-                ai_analysis=f"Fallback conversion used due to: {str(agno_error)}"
-            )
-        
-        # Find newly created Excel files (if Agno created them)
-        files_after = set(glob.glob(os.path.join(TEMP_DIR, "*.xlsx")))
-        new_files = files_after - files_before
-        
-        if new_files:
-            # Use the most recently created file
-            newest_file = max(new_files, key=os.path.getmtime)
-            
-            # Generate file ID
-            file_id = str(uuid.uuid4())
-            original_filename = os.path.basename(newest_file)
-            
-            # Create managed filename
-            managed_filename = f"{file_id}_{original_filename}"
-            managed_path = os.path.join(TEMP_DIR, managed_filename)
-            
-            # Move file to managed location
-            os.rename(newest_file, managed_path)
-            
-            # Store file info
-            temp_files[file_id] = {
-                'path': managed_path,
-                'filename': original_filename,
-                'created_at': datetime.now(),
-                'original_json': request.json_data[:500] + "..." if len(request.json_data) > 500 else request.json_data
-            }
-            
-            print(f"✅ File created successfully: {original_filename}")
-            
-            return ProcessResponse(
-                success=True,
-                file_id=file_id,
-                file_name=original_filename,
-                download_url=f"/download/{file_id}",
-                ai_analysis=ai_response
-            )
-        else:
             # No file created by AI, use direct conversion
             print("⚠️ No file created by AI, using direct conversion...")
+            fallback_reason = "Direct conversion used - AI did not create output file"
+        
+        with metrics.stage('direct_conversion'):
             file_id, xlsx_filename, file_path = direct_json_to_excel(
                 request.json_data, 
-                request.file_name
-            )
-            
-            # Store file info
-            temp_files[file_id] = {
-                'path': file_path,
-                'filename': xlsx_filename,
-                'created_at': datetime.now(),
-                'original_json': request.json_data[:500] + "..." if len(request.json_data) > 500 else request.json_data
-            }
-            
-            return ProcessResponse(
-                success=True,
-                file_id=file_id,
-                file_name=xlsx_filename,
-                download_url=f"/download/{file_id}",
-                ai_analysis="Direct conversion used - AI did not create output file"
+                request.file_name,
+                request.normalization
             )
         
+        diagnostics = metrics.finish(file_id, file_path)
+        store_file_info(file_id, file_path, xlsx_filename, request.json_data, diagnostics, request.normalization)
+        
+        return ProcessResponse(
+            success=True,
+            file_id=file_id,
+            file_name=xlsx_filename,
+            download_url=f"/download/{file_id}",
+            ai_analysis=fallback_reason,
+            diagnostics=diagnostics
+        )
+        
     except HTTPException:
+        metrics.finish()
         raise
     except Exception as e:
         print(f"❌ Error processing data: {str(e)}")
         return ProcessResponse(
             success=False,
-            error=f"Processing failed: {str(e)}"
+            error=f"Processing failed: {str(e)}",
+            diagnostics=metrics.finish()
         )
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 @app.get("/download/{file_id}")
 async def download_file(file_id: str):
     """Download a generated XLSX file"""
     
-    if file_id not in temp_files:
+    file_info = temp_files.get(file_id)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="File not found or expired")
     
-    file_info = temp_files[file_id]
     file_path = file_info['path']
     
     if not os.path.exists(file_path):
         # Clean up the reference if file doesn't exist
-        if file_id in temp_files:
-            del temp_files[file_id]
+        temp_files.pop(file_id, None)
         raise HTTPException(status_code=404, detail="File not found on disk")
     
+    if file_info.get('dirty'):
+        # Appended records are only written into the workbook when it is requested
+        await run_in_threadpool(materialize_workbook, file_id)
+    
     return FileResponse(
         path=file_path,
         filename=file_info['filename'],
         media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
 
+@app.post("/files/{file_id}/append", response_model=ProcessResponse)
+async def append_json_data(file_id: str, request: AppendRequest):
+    """Append JSON records to an existing generated workbook"""
+    
+    file_info = temp_files.get(file_id)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    if file_info.get('normalization') == "relational":
+        raise HTTPException(status_code=409, detail="Appending to relational workbooks is not supported")
+    
+    metrics = RequestMetrics(f"append:{file_id}", len(request.json_data.encode('utf-8')))
+    
+    try:
+        with metrics.stage('validate'):
+            try:
+                json.loads(request.json_data)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+        
+        async with direct_lane.admit(len(request.json_data)):
+            appended = await run_in_threadpool(metrics.run_stage, 'append', append_to_workbook, file_id, request.json_data)
+        
+        diagnostics = metrics.finish(file_id)
+        
+        summary = ", ".join(f"{rows} rows to '{sheet}'" for sheet, rows in appended.items())
+        print(f"➕ Appended to {file_info['filename']}: {summary}")
+        
+        return ProcessResponse(
+            success=True,
+            file_id=file_id,
+            file_name=file_info['filename'],
+            download_url=f"/download/{file_id}",
+            ai_analysis=f"Appended {summary}",
+            diagnostics=diagnostics
+        )
+        
+    except HTTPException:
+        metrics.finish(file_id)
+        raise
+    except Exception as e:
+        print(f"❌ Error appending data: {str(e)}")
+        return ProcessResponse(
+            success=False,
+            error=f"Append failed: {str(e)}",
+            diagnostics=metrics.finish(file_id)
+        )
+
+@app.post("/merge", response_model=ProcessResponse)
+async def merge_documents(request: MergeRequest):
+    """Merge many JSON documents and/or generated files into one workbook"""
+    
+    documents = request.documents or []
+    file_ids = request.file_ids or []
+    if not documents and not file_ids:
+        raise HTTPException(status_code=400, detail="Provide documents and/or file_ids to merge")
+    
+    # Snapshot the sources: the registry is updated concurrently by worker threads
+    source_infos = {file_id: temp_files.get(file_id) for file_id in file_ids}
+    missing = [file_id for file_id, file_info in source_infos.items() if file_info is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found or expired: {', '.join(missing)}")
+    
+    # Inline documents arrive in the request body and stay in memory for the whole merge;
+    # large merges should reference workbooks from /process by file_id, which stream from disk
+    documents_bytes = sum(len(doc.json_data.encode('utf-8')) for doc in documents)
+    if documents_bytes > MERGE_MAX_DOCUMENT_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Inline documents exceed {MERGE_MAX_DOCUMENT_BYTES} bytes; convert them with /process and merge by file_ids"
+        )
+    
+    metrics = RequestMetrics(request.file_name, documents_bytes)
+    
+    try:
+        load_engines()
+        
+        file_id = str(uuid.uuid4())
+        safe_filename = "".join(c for c in request.file_name if c.isalnum() or c in (' ', '-', '_')).strip()
+        xlsx_filename = f"{safe_filename}_merged.xlsx"
+        file_path = os.path.join(TEMP_DIR, f"{file_id}_{xlsx_filename}")
+        
+        sources = []
+        seen = {}
+        for index, document in enumerate(documents):
+            name = document.file_name or f"document_{index + 1}"
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                name = f"{name} ({seen[name]})"
+            sources.append((name, lambda json_data=document.json_data: iter_document_record_sets(json_data)))
+        for source_id in file_ids:
+            sources.append((source_infos[source_id]['filename'], lambda source_id=source_id: iter_file_record_sets(source_id)))
+        
+        async with direct_lane.admit(documents_bytes):
+            result = await run_in_threadpool(metrics.run_stage, 'merge', merge_into_workbook, sources, file_path)
+        
+        diagnostics = metrics.finish(file_id, file_path)
+        store_file_info(file_id, file_path, xlsx_filename, f"Merged {result['documents']} documents", diagnostics)
+        
+        print(f"🧩 Merged {result['documents']} documents into {result['sheets']} sheets: {xlsx_filename}")
+        
+        analysis = f"Merged {result['documents']} documents into {result['sheets']} sheets"
+        if result['skipped']:
+            analysis += f" ({result['skipped']} inputs skipped, see Merge Summary sheet)"
+        
+        return ProcessResponse(
+            success=True,
+            file_id=file_id,
+            file_name=xlsx_filename,
+            download_url=f"/download/{file_id}",
+            ai_analysis=analysis,
+            diagnostics=diagnostics
+        )
+        
+    except HTTPException:
+        metrics.finish()
+        raise
+    except Exception as e:
+        print(f"❌ Error merging documents: {str(e)}")
+        return ProcessResponse(
+            success=False,
+            error=f"Merge failed: {str(e)}",
+            diagnostics=metrics.finish()
+        )
+
+@app.get("/files/{file_id}/preview")
+async def preview_file(file_id: str, rows: int = 20):
+    """Sheet names, headers, row counts and first rows of a generated workbook"""
+    
+    file_info = temp_files.get(file_id)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    
+    if not os.path.exists(file_info['path']):
+        raise HTTPException(status_code=404, detail="File not found on disk")
+    
+    preview = file_info.get('sheet_preview')
+    if preview is None:
+        preview = await run_in_threadpool(load_preview, file_id)
+    
+    rows = max(0, min(rows, PREVIEW_ROWS))
+    return {
+        'success': True,
+        'file_id': file_id,
+        'file_name': file_info['filename'],
+        'generated_at': preview.get('generated_at'),
+        'sheets': [dict(sheet, rows=sheet['rows'][:rows]) for sheet in preview['sheets']]
+    }
+
 @app.get("/files")
 async def list_files():
     """List all current temporary files"""
     
     file_list = []
-    for file_id, file_info in temp_files.items():
+    # Copy first: worker threads register files while this iterates
+    for file_id, file_info in list(temp_files.items()):
         file_list.append({
             'file_id': file_id,
             'filename': file_info['filename'],
             'created_at': file_info['created_at'].isoformat(),
             'download_url': f"/download/{file_id}",
-            'preview': file_info.get('original_json', 'N/A')[:100] + "..."
+            'preview': file_info.get('original_json', 'N/A')[:100] + "...",
+            'diagnostics': file_info.get('diagnostics')
         })
     
     return {
@@ -436,7 +2304,9 @@ async def cleanup_all_files():
             if os.path.exists(file_path):
                 os.remove(file_path)
                 files_deleted += 1
+            remove_file_sidecars(file_info)
             del temp_files[file_id]
+            file_locks.pop(file_id, None)
         
         return {
             'success': True, 
@@ -449,18 +2319,116 @@ async def cleanup_all_files():
             'error': str(e)
         }
 
+@app.get("/diagnostics/heaviest")
+async def heaviest_requests(by: Optional[str] = None, limit: int = 10):
+    """Top-N most expensive recent requests, ranked by the chosen metric (default: memory)"""
+    
+    if by is None:
+        by = 'peak_memory_bytes' if MEMORY_TRACKING == "tracemalloc" else 'rss_growth_bytes'
+    metrics_keys = ('peak_memory_bytes', 'rss_growth_bytes', 'cpu_seconds', 'wall_seconds', 'input_bytes', 'output_bytes')
+    if by not in metrics_keys:
+        raise HTTPException(status_code=400, detail=f"'by' must be one of: {', '.join(metrics_keys)}")
+    
+    ranked = sorted(
+        list(request_metrics_log),
+        key=lambda entry: entry.get(by) or 0,
+        reverse=True
+    )[:max(1, min(limit, 100))]
+    
+    return {
+        'success': True,
+        'by': by,
+        'window': len(request_metrics_log),
+        'requests': ranked
+    }
+
+@app.get("/debug/traces")
+async def list_traces(limit: int = 20, min_duration_ms: float = 0):
+    """Most recent request traces, newest first (optionally only slow ones)"""
+    
+    with trace_lock:
+        recent = [(trace_id, list(spans)) for trace_id, spans in trace_buffer.items()]
+    
+    traces = []
+    for trace_id, spans in reversed(recent):
+        root = next((span for span in spans if span['parent_id'] is None), None)
+        duration = root['duration_ms'] if root else None
+        if min_duration_ms and (duration or 0) < min_duration_ms:
+            continue
+        traces.append({
+            'trace_id': trace_id,
+            'name': root['name'] if root else None,
+            'path': root['attributes'].get('path') if root else None,
+            'status_code': root['attributes'].get('status_code') if root else None,
+            'start': min(span['start'] for span in spans),
+            'duration_ms': duration,
+            'span_count': len(spans),
+            'status': 'error' if any(span['status'] == 'error' for span in spans) else 'ok'
+        })
+        if len(traces) >= limit:
+            break
+    
+    return {
+        'success': True,
+        'traces': traces,
+        'count': len(traces)
+    }
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """All spans of one trace as a tree"""
+    
+    with trace_lock:
+        spans = list(trace_buffer.get(trace_id, []))
+    
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found or evicted")
+    
+    nodes = {span['span_id']: dict(span, children=[]) for span in spans}
+    roots = []
+    for node in sorted(nodes.values(), key=lambda node: node['start']):
+        parent = nodes.get(node['parent_id'])
+        (parent['children'] if parent else roots).append(node)
+    
+    return {
+        'success': True,
+        'trace_id': trace_id,
+        'spans': roots
+    }
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check endpoint (does not wait for the conversion engines)"""
     
     return {
         "status": "healthy", 
+        "ready": engine_status['state'] == 'ready',
         "service": "Agno AI JSON to XLSX Processing API",
         "version": "2.1.0",
         "temp_files_count": len(temp_files),
-        "temp_directory": TEMP_DIR
+        "temp_directory": TEMP_DIR,
+        "llm_circuits": llm_breaker.snapshot(),
+        "admission": {
+            "agent": agent_lane.snapshot(),
+            "direct": direct_lane.snapshot()
+        }
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check endpoint: 200 only once the conversion engines are loaded"""
+    
+    ready = engine_status['state'] == 'ready'
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "engines": engine_status['state'],
+            "load_seconds": engine_status['load_seconds'],
+            "error": engine_status['error']
+        }
+    )
+
 @app.get("/")
 async def root():
     """API documentation"""
@@ -473,14 +2441,26 @@ async def root():
             "POST /process": "Process single JSON to XLSX",
             "GET /download/{file_id}": "Download generated XLSX file",
             "GET /files": "List all generated files",
+            "POST /files/{file_id}/append": "Append JSON records to an existing XLSX file",
+            "GET /files/{file_id}/preview": "Sheet names, headers, row counts and first rows as JSON",
+            "POST /merge": "Merge many JSON documents and/or files into one XLSX file",
+            "GET /diagnostics/heaviest": "Most expensive recent requests (memory, CPU, time, bytes)",
+            "GET /debug/traces": "Recent request traces (trace id is returned in X-Trace-Id)",
+            "GET /debug/traces/{trace_id}": "Span tree of one request",
             "DELETE /cleanup": "Clean up all temporary files",
-            "GET /health": "Health check"
+            "GET /health": "Liveness check",
+            "GET /ready": "Readiness check (conversion engines loaded)"
         },
         "features": [
             "Automatic fallback for large JSON files",
             "Direct conversion for files >100KB",
             "Improved error handling",
-            "Multiple sheet support for complex JSON structures"
+            "LLM deadlines, retries and per-model circuit breaker with direct fallback",
+            "Multiple sheet support for complex JSON structures",
+            "gzip/zstd compressed request bodies",
+            "Admission control (503 + Retry-After) and per-API-key rate limiting (429)",
+            "Token-compact inline prompts (minified, column tables, repeated-value refs)",
+            "Relational normalization: nested arrays as linked child sheets"
         ]
     }
 
@@ -1,4 +1,11 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { gzip } from 'zlib';
+import { promisify } from 'util';
+
+const gzipAsync = promisify(gzip);
+
+// Payloads smaller than this are sent as plain JSON; compression isn't worth it
+const COMPRESSION_MIN_BYTES = 8 * 1024;
 
 export async function POST(request: NextRequest) {
   try {
@@ -27,18 +34,26 @@ export async function POST(request: NextRequest) {
     // Forward request to Python backend
     const pythonBackendUrl = process.env.AGNO_BACKEND_URL || 'http://localhost:8001';
     
+    const payload = JSON.stringify({
+      json_data: extractedData,  // Changed from extracted_data to match Python API
+      file_name: fileName,
+      description: `Extracted from ${fileName} using ${llmProvider}/${model}`,
+      api_key: finalApiKey,  // Use the resolved API key
+      model: model  // Python backend will use this model for Agno processing
+    });
+
+    // Extraction JSON compresses well; gzip large payloads (Python API decodes Content-Encoding)
+    const compressRequest = process.env.AGNO_REQUEST_COMPRESSION !== 'off'
+      && Buffer.byteLength(payload) >= COMPRESSION_MIN_BYTES;
+    const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+    if (compressRequest) {
+      headers['Content-Encoding'] = 'gzip';
+    }
+
     const response = await fetch(`${pythonBackendUrl}/process`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({
-        json_data: extractedData,  // Changed from extracted_data to match Python API
-        file_name: fileName,
-        description: `Extracted from ${fileName} using ${llmProvider}/${model}`,
-        api_key: finalApiKey,  // Use the resolved API key
-        model: model  // Python backend will use this model for Agno processing
-      }),
+      headers,
+      body: compressRequest ? await gzipAsync(payload) : payload,
     });
 
     if (!response.ok) {